@@ -1,32 +1,116 @@
-from openai import OpenAI
 import json
+from mail_sorter import get_openai_client, json_loads
 from gmail import SCOPES, build
 from google.oauth2.credentials import Credentials
+import google_auth_httplib2
+import httplib2
 import base64
-from email.mime.text import MIMEText
-from dotenv import load_dotenv
-import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import re
-
-load_dotenv(override=True)
+import threading
+
+# Cheap prefilter for create_response: if this doesn't hit, the
+# location/agenda alternations cannot match and the scans are skipped.
+# The short stems are followed by \s exactly like the patterns they guard
+# (a trailing literal space would wrongly reject "at\tHogwarts"), so the
+# guard only ever errs toward running the full regexes.
+_SCAN_TRIGGER_RE = re.compile(
+    r'(?:at|in|meet|for)\s|location|about|discuss|regarding|re:|topic|agenda|purpose'
+)
+
+# Credentials and the Gmail service are built once per process; re-reading
+# token.json and re-running service discovery for every EmailAgent cost
+# roughly a second of cold start each time
+_CREDS = None
+_SERVICE = None
+
+
+def encode_email_message(to_email, subject, message_text):
+    """Build the base64url raw message the Gmail API expects.
+
+    The responses are plain text, so a byte template replaces the full
+    email.mime policy stack (charset detection, header folding, CTE
+    selection) that MIMEText ran per message. Newlines are stripped from
+    headers since Gmail rejects folded injected headers anyway.
+    """
+    to_email = to_email.replace('\r', ' ').replace('\n', ' ')
+    subject = subject.replace('\r', ' ').replace('\n', ' ')
+    raw = (
+        f"To: {to_email}\r\n"
+        f"Subject: {subject}\r\n"
+        "MIME-Version: 1.0\r\n"
+        'Content-Type: text/plain; charset="utf-8"\r\n'
+        "Content-Transfer-Encoding: 8bit\r\n"
+        "\r\n"
+        f"{message_text}"
+    )
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def get_gmail_service():
+    global _CREDS, _SERVICE
+    if _SERVICE is None:
+        _CREDS = Credentials.from_authorized_user_file('token.json', SCOPES)
+        _SERVICE = build('gmail', 'v1', credentials=_CREDS, static_discovery=True)
+    return _SERVICE
+
+
+# The service's own httplib2 transport is not thread-safe; concurrent
+# executes on it interleave request/response state on one connection.
+# Workers sending in parallel each get their own AuthorizedHttp instead.
+_THREAD_HTTP = threading.local()
+
+
+def get_thread_http():
+    http = getattr(_THREAD_HTTP, 'http', None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(_CREDS, http=httplib2.Http())
+        _THREAD_HTTP.http = http
+    return http
 
 
 class EmailAgent:
+    # Each pattern family fused into one alternation compiled at class
+    # creation, so one scan per family replaces the per-pattern loop. The
+    # families stay separate: folding both into a single non-overlapping
+    # finditer would let an agenda match swallow the location text
+    # ("...Discuss the project at Hogwarts" loses "at Hogwarts")
+    LOCATION_RE = re.compile('|'.join((
+        r'at\s+(?P<loc_at>[^\.!?\n]+)',  # "at the office"
+        r'in\s+(?P<loc_in>[^\.!?\n]+)',  # "in the conference room"
+        r'location:\s*(?P<loc_label>[^\.!?\n]+)',  # "location: office"
+        r'meet\s+(?:at|in)\s+(?P<loc_meet>[^\.!?\n]+)'  # "meet at Starbucks"
+    )), re.IGNORECASE)
+
+    AGENDA_RE = re.compile('|'.join((
+        r'(?:about|discuss|regarding|re:|topic:|agenda:)\s+(?P<agenda_topic>[^\.!?\n]+)',  # "to discuss project status"
+        r'for\s+(?P<agenda_for>[^\.!?\n]+\s+(?:meeting|discussion|sync|catch-up))',  # "for project status meeting"
+        r'purpose:\s*(?P<agenda_label>[^\.!?\n]+)'  # "purpose: project review"
+    )), re.IGNORECASE)
+
     def __init__(self):
-        # Initialize OpenAI client for potential future use with more complex responses
-        self.client = OpenAI(
-            api_key=os.getenv('OPENAI_API_KEY')
-        )
+        # Shared OpenAI client (one httpx pool per process) for potential
+        # future use with more complex responses
+        self.client = get_openai_client()
         # Initialize list of files that need cleanup after processing
         self.files_to_cleanup = [
             'emails.txt',
             'meeting_mails.json',
             'schedule.json'
         ]
-        self.load_schedule()
-        self.load_response_log()
-        self.setup_gmail_service()
+        # Guards the response log when meetings are processed concurrently
+        self.log_lock = threading.Lock()
+        # Memoized letters keyed on inputs + schedule version (chunk2-17)
+        self._response_cache = {}
+        # The three startup loads read independent files (schedule, response
+        # log, token.json via the service build), so overlap their I/O;
+        # result() re-raises any loader failure just like the serial calls
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            for task in [pool.submit(self.load_schedule),
+                         pool.submit(self.load_response_log),
+                         pool.submit(self.setup_gmail_service)]:
+                task.result()
 
     def load_schedule(self):
         """Load or create the schedule JSON file that tracks all meetings"""
@@ -34,29 +118,52 @@ class EmailAgent:
             with open('schedule.json', 'r') as f:
                 content = f.read().strip()
                 if content:  # Check if file has content
-                    self.schedule = json.load(f)
+                    self.schedule = json_loads(content)
                 else:
                     self.schedule = {"meetings": []}
-        except (FileNotFoundError, json.JSONDecodeError):
+        except (FileNotFoundError, ValueError):
             self.schedule = {"meetings": []}
             # Create the file with default structure
             with open('schedule.json', 'w') as f:
                 json.dump(self.schedule, f, indent=2)
 
+        # Index booked (date, time) slots once so availability checks are
+        # O(1) instead of a scan over the whole schedule
+        self.booked_slots = {(m['date'], m['time']) for m in self.schedule['meetings']}
+        # Any schedule change invalidates memoized responses
+        self._schedule_version = getattr(self, '_schedule_version', -1) + 1
+
     def load_response_log(self):
-        """Load or create the response log that tracks all email responses"""
+        """Load the response log from the legacy JSON snapshot plus the
+        append-only JSONL records written since (see save_response_log)."""
+        responses = []
+
         try:
             with open('email_responses.json', 'r') as f:
                 content = f.read().strip()
                 if content:
-                    self.response_log = json.load(f)
-                else:
-                    self.response_log = {"responses": []}
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.response_log = {"responses": []}
-            # Create the file with default structure
-            with open('email_responses.json', 'w') as f:
-                json.dump(self.response_log, f, indent=2)
+                    responses = json_loads(content).get("responses", [])
+        except (FileNotFoundError, ValueError):
+            pass
+
+        try:
+            with open('email_responses.jsonl', 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        responses.append(json_loads(line))
+                    except ValueError:
+                        print("Warning: skipping corrupt line in email_responses.jsonl")
+        except FileNotFoundError:
+            pass
+
+        self.response_log = {"responses": responses}
+
+        # Index the responded email ids once so duplicate checks are O(1)
+        # instead of scanning the whole log for every email
+        self.responded_ids = {r["email_id"] for r in responses}
 
     def cleanup_files(self):
         """
@@ -85,6 +192,8 @@ class EmailAgent:
 
             # Update internal schedule state
             self.schedule = default_schedule_state
+            self.booked_slots = set()
+            self._schedule_version = getattr(self, '_schedule_version', -1) + 1
 
             return True
         except Exception as e:
@@ -92,70 +201,102 @@ class EmailAgent:
             return False
 
     def save_response_log(self, email_id, response_data):
-        """Save a new response to the log with timestamp"""
-        self.response_log["responses"].append({
+        """Save a new response to the log with timestamp.
+
+        Each response is appended as one compact JSON line; rewriting the
+        whole log per response made the write cost grow with log size.
+        """
+        record = {
             "email_id": email_id,
             "response_time": datetime.now().isoformat(),
             "response_data": response_data
-        })
-        with open('email_responses.json', 'w') as f:
-            json.dump(self.response_log, f, indent=2)
+        }
+        with self.log_lock:
+            self.response_log["responses"].append(record)
+            self.responded_ids.add(email_id)
+            with open('email_responses.jsonl', 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
 
     def has_responded(self, email_id):
         """Check if we've already responded to this email"""
-        return any(r["email_id"] == email_id for r in self.response_log["responses"])
+        return email_id in self.responded_ids
 
     def setup_gmail_service(self):
-        """Initialize the Gmail API service"""
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-        self.service = build('gmail', 'v1', credentials=creds)
+        """Attach the shared per-process Gmail API service"""
+        self.service = get_gmail_service()
 
     def check_availability(self, date, time):
         """Check if the proposed time slot is available"""
-        for meeting in self.schedule['meetings']:
-            if meeting['date'] == date and meeting['time'] == time:
-                return False
-        return True
+        return (date, time) not in self.booked_slots
+
+    def create_response(self, email_content, sender_name, proposed_date, proposed_time, structured=None):
+        """Memoizing wrapper around _build_response.
 
-    def create_response(self, email_content, sender_name, proposed_date, proposed_time):
+        Identical requests recur when a cycle is re-run before cleanup; the
+        cache key includes the schedule version so availability changes
+        invalidate stale letters.
+        """
+        structured_key = tuple(sorted(structured.items())) if structured else None
+        cache_key = (email_content, sender_name, proposed_date, proposed_time,
+                     structured_key, self._schedule_version)
+        cached = self._response_cache.get(cache_key)
+        if cached is None:
+            cached = self._build_response(email_content, sender_name, proposed_date,
+                                          proposed_time, structured)
+            if len(self._response_cache) >= 1024:
+                self._response_cache.clear()
+            self._response_cache[cache_key] = cached
+        return cached
+
+    def _build_response(self, email_content, sender_name, proposed_date, proposed_time, structured=None):
         """
         Creates a response to meeting requests, checking for three essential elements:
         1. Time (date and time)
         2. Location/Place
         3. Agenda/Purpose
+
+        When the caller already has the meeting fields in structured form
+        (a dict with date, time, location and agenda), the regex scan over
+        the email text is skipped entirely.
         """
-        # Initialize dictionary to track missing information
-        missing_info = {
-            'time': not (proposed_time and proposed_time.strip()),
-            'date': not (proposed_date and proposed_date.strip()),
-            'location': True,  # Default to True, will update in check
-            'agenda': True  # Default to True, will update in check
-        }
+        # Fast path: everything we would regex out of the text is already known
+        if structured and all(structured.get(k) for k in ('date', 'time', 'location', 'agenda')):
+            if not self.check_availability(structured['date'], structured['time']):
+                return f"""Dear {sender_name},
 
-        # Check for location using various common patterns
-        location_patterns = [
-            r'at\s+([^\.!?\n]+)',  # "at the office"
-            r'in\s+([^\.!?\n]+)',  # "in the conference room"
-            r'location:\s*([^\.!?\n]+)',  # "location: office"
-            r'meet\s+(?:at|in)\s+([^\.!?\n]+)'  # "meet at Starbucks"
-        ]
+Thank you for your meeting request. I will review your proposed meeting time ({structured['date']} at {structured['time']}) and get back to you within 24 hours.
 
-        for pattern in location_patterns:
-            if re.search(pattern, email_content, re.IGNORECASE):
-                missing_info['location'] = False
-                break
+Best regards,
+Ivaylo's AI Assistant"""
 
-        # Check for agenda/purpose using common patterns
-        agenda_patterns = [
-            r'(?:about|discuss|regarding|re:|topic:|agenda:)\s+([^\.!?\n]+)',  # "to discuss project status"
-            r'for\s+([^\.!?\n]+\s+(?:meeting|discussion|sync|catch-up))',  # "for project status meeting"
-            r'purpose:\s*([^\.!?\n]+)'  # "purpose: project review"
-        ]
+            return f"""Dear {sender_name},
+
+Thank you for your meeting request. I am pleased to confirm our meeting on {structured['date']} at {structured['time']} at {structured['location']} to discuss {structured['agenda']}.
+
+Best regards,
+Ivaylo's AI Assistant"""
 
-        for pattern in agenda_patterns:
-            if re.search(pattern, email_content, re.IGNORECASE):
-                missing_info['agenda'] = False
-                break
+        # Fast reject: skip both regex scans when no trigger stem appears
+        location_text = None
+        agenda_text = None
+        lowered = email_content.lower()
+        if _SCAN_TRIGGER_RE.search(lowered):
+            # One scan per family; the named group that fired carries the text
+            location_match = self.LOCATION_RE.search(email_content)
+            if location_match:
+                location_text = location_match.group(location_match.lastgroup).strip()
+
+            agenda_match = self.AGENDA_RE.search(email_content)
+            if agenda_match:
+                agenda_text = agenda_match.group(agenda_match.lastgroup).strip()
+
+        # Track which of the essential elements are missing
+        missing_info = {
+            'time': not (proposed_time and proposed_time.strip()),
+            'date': not (proposed_date and proposed_date.strip()),
+            'location': location_text is None,
+            'agenda': agenda_text is None
+        }
 
         # If we're missing any information, create a response asking for all missing items
         if any(missing_info.values()):
@@ -190,48 +331,59 @@ Thank you for your meeting request. I will review your proposed meeting time ({p
 Best regards,
 Ivaylo's AI Assistant"""
 
-        # Extract location and agenda for confirmation
-        location_match = None
-        for pattern in location_patterns:
-            match = re.search(pattern, email_content, re.IGNORECASE)
-            if match:
-                location_match = match.group(1).strip()
-                break
-
-        agenda_match = None
-        for pattern in agenda_patterns:
-            match = re.search(pattern, email_content, re.IGNORECASE)
-            if match:
-                agenda_match = match.group(1).strip()
-                break
-
         return f"""Dear {sender_name},
 
-Thank you for your meeting request. I am pleased to confirm our meeting on {proposed_date} at {proposed_time} at {location_match} to discuss {agenda_match}.
+Thank you for your meeting request. I am pleased to confirm our meeting on {proposed_date} at {proposed_time} at {location_text} to discuss {agenda_text}.
 
 Best regards,
 Ivaylo's AI Assistant"""
 
     def send_email(self, to_email, subject, message_text):
         """Send an email using Gmail API"""
-        message = MIMEText(message_text)
-        message['to'] = to_email
-        message['subject'] = subject
-
-        # Encode the message
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+        raw_message = encode_email_message(to_email, subject, message_text)
 
         try:
             self.service.users().messages().send(
                 userId="me",
                 body={'raw': raw_message}
-            ).execute()
+            ).execute(http=get_thread_http())
             return True
         except Exception as e:
             print(f"Error sending email: {e}")
             return False
 
-    def process_meeting_request(self, email_id, email_content, sender_info, subject, proposed_date, proposed_time):
+    def send_email_batch(self, messages):
+        """Send several emails through a single Gmail batch request.
+
+        messages is a list of (to_email, subject, message_text) tuples.
+        Returns a list of booleans in the same order, one per message.
+        The batch endpoint takes up to 100 sub-requests, so larger runs
+        are chunked.
+        """
+        results = [False] * len(messages)
+
+        def handle_send(request_id, response, exception):
+            if exception is None:
+                results[int(request_id)] = True
+            else:
+                print(f"Error sending email (batch item {request_id}): {exception}")
+
+        for start in range(0, len(messages), 100):
+            batch = self.service.new_batch_http_request(callback=handle_send)
+            for i, (to_email, subject, message_text) in enumerate(messages[start:start + 100], start=start):
+                raw_message = encode_email_message(to_email, subject, message_text)
+                batch.add(
+                    self.service.users().messages().send(userId="me", body={'raw': raw_message}),
+                    request_id=str(i)
+                )
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"Error executing send batch: {e}")
+
+        return results
+
+    def process_meeting_request(self, email_id, email_content, sender_info, subject, proposed_date, proposed_time, structured=None):
         """Process a meeting request and send an appropriate response"""
         try:
             # Check if we've already responded to this email
@@ -244,7 +396,8 @@ Ivaylo's AI Assistant"""
                 email_content,
                 sender_info['name'],
                 proposed_date,
-                proposed_time
+                proposed_time,
+                structured=structured
             )
 
             if not subject or subject.strip() == "":
@@ -258,7 +411,8 @@ Ivaylo's AI Assistant"""
             )
 
             if success:
-                # Log the response
+                # Log the response; file cleanup happens once per run in the
+                # callers, not after every message
                 self.save_response_log(email_id, {
                     "sender": sender_info,
                     "subject": subject,
@@ -266,12 +420,6 @@ Ivaylo's AI Assistant"""
                     "time": proposed_time,
                     "response": response_text
                 })
-
-                # Clean up files after successful processing
-                cleanup_success = self.cleanup_files()
-                if not cleanup_success:
-                    print("Warning: Files cleanup failed after sending email")
-
                 return True
             return False
 
@@ -289,28 +437,73 @@ def main():
     try:
         # Process meetings from meeting_mails.json
         with open('meeting_mails.json', 'r') as f:
-            meeting_data = json.load(f)
+            meeting_data = json_loads(f.read())
 
         total_meetings = len(meeting_data.get("meetings", []))
 
+        # Prepare every response first; the sends then go out in one Gmail
+        # batch request instead of one HTTPS round-trip per meeting
+        pending = []
+        seen_ids = set()
         for meeting in meeting_data.get("meetings", []):
             try:
-                result = agent.process_meeting_request(
-                    email_id=f"{meeting['date']}_{meeting['time']}_{meeting['sender']['email']}",
-                    email_content=f"Meeting request for {meeting['topic']} at {meeting['location']}",
-                    sender_info=meeting['sender'],
-                    subject=meeting['topic'],
-                    proposed_date=meeting['date'],
-                    proposed_time=meeting['time']
+                email_id = f"{meeting['date']}_{meeting['time']}_{meeting['sender']['email']}"
+
+                # Check the pre-run log and the ids already queued this run;
+                # nothing is logged until after the batch, so without the
+                # in-batch set two stored meetings sharing an id would both
+                # be sent (same hazard main.py guards with seen_ids)
+                if agent.has_responded(email_id) or email_id in seen_ids:
+                    print(f"Already responded to email {email_id}")
+                    error_count += 1
+                    continue
+
+                seen_ids.add(email_id)
+
+                response_text = agent.create_response(
+                    f"Meeting request for {meeting['topic']} at {meeting['location']}",
+                    meeting['sender']['name'],
+                    meeting['date'],
+                    meeting['time'],
+                    structured={
+                        'date': meeting['date'],
+                        'time': meeting['time'],
+                        'location': meeting['location'],
+                        'agenda': meeting['topic']
+                    }
                 )
 
-                if result:
-                    success_count += 1
-                else:
-                    error_count += 1
+                subject = meeting['topic']
+                if not subject or subject.strip() == "":
+                    subject = "Meeting Request"
+                subject_prefix = "Re: " if not subject.startswith("Re:") else ""
+
+                pending.append({
+                    "email_id": email_id,
+                    "meeting": meeting,
+                    "subject": subject,
+                    "response": response_text,
+                    "message": (meeting['sender']['email'], f"{subject_prefix}{subject}", response_text)
+                })
 
             except Exception as e:
-                print(f"Error processing individual meeting: {e}")
+                print(f"Error preparing individual meeting: {e}")
+                error_count += 1
+
+        results = agent.send_email_batch([p["message"] for p in pending]) if pending else []
+
+        # Log only the sends the batch callback confirmed as successful
+        for item, sent in zip(pending, results):
+            if sent:
+                agent.save_response_log(item["email_id"], {
+                    "sender": item["meeting"]['sender'],
+                    "subject": item["subject"],
+                    "date": item["meeting"]['date'],
+                    "time": item["meeting"]['time'],
+                    "response": item["response"]
+                })
+                success_count += 1
+            else:
                 error_count += 1
 
         # Print processing summary
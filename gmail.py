@@ -2,6 +2,7 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
+import base64
 import os.path
 
 # Define the scopes your app needs
@@ -22,6 +23,42 @@ def mark_as_read(service, user_id, message_id):
         return False
 
 
+def mark_all_as_read(service, user_id, message_ids):
+    """Mark a whole batch of messages as read with a single batchModify call.
+
+    One API round-trip covers up to 1000 ids, instead of one modify call
+    per message.
+    """
+    if not message_ids:
+        return True
+    try:
+        service.users().messages().batchModify(
+            userId=user_id,
+            body={'ids': message_ids, 'removeLabelIds': ['UNREAD']}
+        ).execute()
+        return True
+    except Exception as e:
+        print(f"Error marking {len(message_ids)} messages as read: {e}")
+        return False
+
+
+def _first_text_plain(payload):
+    """Depth-first search for the first text/plain part carrying content.
+
+    Gmail nests parts (multipart/alternative inside multipart/mixed), so a
+    flat scan of the top-level parts misses the plain-text body of messages
+    with attachments. Short-circuits on the first hit instead of walking the
+    rest of the tree.
+    """
+    if payload.get('mimeType') == 'text/plain' and payload.get('body'):
+        return payload
+    for part in payload.get('parts', ()):
+        found = _first_text_plain(part)
+        if found is not None:
+            return found
+    return None
+
+
 def main():
     creds = None
     # Token storage
@@ -41,55 +78,82 @@ def main():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
 
-    # Build the Gmail service
-    service = build('gmail', 'v1', credentials=creds)
+    # Build the Gmail service from the discovery document bundled with the
+    # client library, skipping the HTTPS fetch of it on every run
+    service = build('gmail', 'v1', credentials=creds, static_discovery=True)
 
     # Get unread emails
     results = service.users().messages().list(
         userId='me',
         labelIds=['UNREAD'],
-        maxResults=50  # Add a limit to prevent processing too many emails at once
+        maxResults=50,  # Add a limit to prevent processing too many emails at once
+        fields='messages/id'  # Only the ids are used here
     ).execute()
 
     messages = results.get('messages', [])
     count = len(messages)
 
+    # Fetch all message details through the Gmail batch endpoint: one HTTP
+    # round-trip per chunk of 100 ids instead of one per message
+    fetched = {}
+
+    def collect_message(request_id, response, exception):
+        if exception is None:
+            fetched[request_id] = response
+        else:
+            print(f"Error fetching message {request_id}: {exception}")
+
+    for start in range(0, len(messages), 100):
+        batch = service.new_batch_http_request(callback=collect_message)
+        for message in messages[start:start + 100]:
+            batch.add(
+                service.users().messages().get(
+                    userId='me',
+                    id=message['id'],
+                    format='full',
+                    # Server-side mask: only the headers and body slots we
+                    # actually read, instead of the full payload tree with
+                    # snippets, labels and nested part metadata
+                    fields='id,payload/headers,payload/mimeType,payload/body,'
+                           'payload/parts(mimeType,body,parts)'
+                ),
+                request_id=message['id']
+            )
+        batch.execute()
+
+    processed_ids = []
+
     with open('emails.txt', 'w', encoding='utf-8') as f:
         f.write(f'Number of unread emails: {count}\n\n')
 
-        # Get and write details of all unread emails
+        # Write details of all unread emails
         for message in messages:
-            msg = service.users().messages().get(
-                userId='me',
-                id=message['id'],
-                format='full'
-            ).execute()
+            msg = fetched.get(message['id'])
+            if msg is None:
+                continue
 
-            headers = msg['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'No Sender')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'No Date')
+            # One pass over the headers list instead of a scan per field;
+            # lowercased keys since Gmail doesn't guarantee header casing
+            hdr = {h['name'].lower(): h['value'] for h in msg['payload']['headers']}
+            subject = hdr.get('subject', 'No Subject')
+            sender = hdr.get('from', 'No Sender')
+            date = hdr.get('date', 'No Date')
 
             # Get email body
-            if 'parts' in msg['payload']:
-                parts = msg['payload']['parts']
-                body = ''
-                for part in parts:
-                    if part['mimeType'] == 'text/plain':
-                        if 'data' in part['body']:
-                            body = part['body']['data']
-                        elif 'attachmentId' in part['body']:
-                            attachment = service.users().messages().attachments().get(
-                                userId='me', messageId=message['id'],
-                                id=part['body']['attachmentId']
-                            ).execute()
-                            body = attachment['data']
-            else:
-                body = msg['payload']['body'].get('data', '')
+            part = _first_text_plain(msg['payload'])
+            body = ''
+            if part is not None:
+                if 'data' in part['body']:
+                    body = part['body']['data']
+                elif 'attachmentId' in part['body']:
+                    attachment = service.users().messages().attachments().get(
+                        userId='me', messageId=message['id'],
+                        id=part['body']['attachmentId']
+                    ).execute()
+                    body = attachment['data']
 
             # Decode body from base64 if it exists
             if body:
-                import base64
                 body = base64.urlsafe_b64decode(body).decode('utf-8')
             else:
                 body = 'No body content available'
@@ -100,8 +164,10 @@ def main():
             f.write(f'Body:\n{body}\n')
             f.write('-' * 50 + '\n\n')
 
-            # Mark the email as read after processing
-            mark_as_read(service, 'me', message['id'])
+            processed_ids.append(message['id'])
+
+    # Mark everything we processed as read in one batched call
+    mark_all_as_read(service, 'me', processed_ids)
 
 
 if __name__ == '__main__':
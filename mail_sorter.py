@@ -1,69 +1,62 @@
+import hashlib
 import os
-from openai import OpenAI
+import random
+import re
+import time
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
 import json
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import email.utils
 
-load_dotenv(override=True)
-
-
-class MeetingSorter:
-    def __init__(self):
-        self.client = OpenAI()
-        self.json_file = "meeting_mails.json"
-
-    def parse_email_content(self, raw_content: str) -> dict:
-        """Parse the raw email content into structured format."""
-        email_data = {"headers": {}, "body": ""}
-
-        # Skip the "Number of starred emails:" line
-        content_lines = raw_content.split('\n')[2:]
-
-        # Parse headers
-        current_section = "headers"
-        for line in content_lines:
-            if line.startswith('Body:'):
-                current_section = "body"
-                continue
-            elif line.strip() == '' or line.startswith('----'):
-                continue
-
-            if current_section == "headers":
-                if ': ' in line:
-                    key, value = line.split(': ', 1)
-                    email_data["headers"][key] = value
-            else:
-                email_data["body"] += line + "\n"
+try:
+    # C-accelerated JSON decoding for the hot parse paths; stdlib json is a
+    # drop-in fallback when orjson isn't installed
+    import orjson
+except ImportError:
+    orjson = None
 
-        return email_data
+load_dotenv(override=True)
 
-    def extract_meeting_details(self, emails_content: str) -> str:
-        """Extract meeting information from email content."""
-        # Parse the email first
-        email_data = self.parse_email_content(emails_content)
-
-        # Extract sender name and email from the From header
-        from_header = email_data['headers'].get('From', '')
-        sender_name = from_header.split(' <')[0] if ' <' in from_header else from_header
-        sender_email = from_header.split('<')[-1].rstrip('>') if '<' in from_header else from_header
-
-        # Format the email data for the AI to process
-        formatted_content = f"""
-From: {from_header}
-Subject: {email_data['headers'].get('Subject', '')}
-Date: {email_data['headers'].get('Date', '')}
-Content: {email_data['body']}
-"""
-
-        system_prompt = """You are an email analyzer focused on identifying meeting requests.
+# Verbose dumps of model traffic are opt-in; printing the full response on
+# every call costs formatting time and clutters scheduled-run output
+_DEBUG = os.getenv("SENTIENT_DEBUG", "").lower() in ("1", "true", "yes")
+
+
+def json_loads(data):
+    """Decode JSON with orjson when available, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dump_pretty(data, path):
+    """Write pretty-printed, key-sorted JSON to path, via orjson if available.
+
+    Writes to a sibling temp file and renames it into place so a crash
+    mid-write leaves the previous file intact rather than a truncated one
+    that the decode fallbacks would silently reset.
+    """
+    tmp_path = path + '.tmp'
+    if orjson is not None:
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    else:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# Built once at import instead of per call; the boilerplate never changes
+_SYSTEM_PROMPT = """You are an email analyzer focused on identifying meeting requests.
+        You will receive a numbered list of emails. Analyze each one.
         When analyzing emails, look for:
         1. Explicit meeting requests
         2. Date and time mentions (including relative terms like 'tomorrow', 'next week')
         3. Meeting topics or purposes
         4. Location information if provided
 
-        Return a JSON response in this exact format:
+        Return one JSON response covering all meetings found across every
+        email, in this exact format:
         {
             "found_meetings": boolean,
             "meetings": [
@@ -79,34 +72,171 @@ Content: {email_data['body']}
         }
 
         For relative dates like 'tomorrow', calculate the actual date based on the email's sent date.
+        Always return absolute YYYY-MM-DD dates - never relative words like 'tomorrow'.
         If no specific time is mentioned, do not make assumptions - mark the meeting as not found.
         """
 
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": formatted_content}
-                ],
-                temperature=0.1
+# Compiled once at import: strips an optional ```json fence the model
+# sometimes wraps around its response, in a single C-level scan
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+# Record separator and header lines in the emails.txt export; compiled
+# matchers keep the parse in the regex engine instead of per-line Python
+_RECORD_SEP_RE = re.compile(r"^----+\s*$", re.MULTILINE)
+_HEADER_RE = re.compile(r"^([\w-]+): (.*)$", re.MULTILINE)
+
+# Extraction results keyed by content hash: identical email batches (reruns,
+# duplicate notifications) skip the model call entirely. Bounded so a
+# long-lived process can't grow it without limit.
+_extraction_cache = {}
+_EXTRACTION_CACHE_SIZE = 128
+
+# Shared OpenAI client so every MeetingSorter reuses the same HTTP connection
+# pool instead of paying a fresh TLS handshake per instance
+_openai_client = None
+
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI()
+    return _openai_client
+
+
+class MeetingSorter:
+    def __init__(self):
+        self.client = get_openai_client()
+        self.json_file = "meeting_mails.json"
+
+    def parse_emails(self, raw_content: str) -> list:
+        """Parse the raw export into one structured dict per email record.
+
+        Records in emails.txt are separated by dashed lines; the old parser
+        collapsed the whole file into a single pseudo-email, folding every
+        message after the first into the body of the first.
+        """
+        # Skip the "Number of unread emails:" line
+        content = raw_content.split('\n', 2)[-1]
+
+        emails = []
+        for block in _RECORD_SEP_RE.split(content):
+            header_part, sep, body_part = block.partition('\nBody:')
+            if not sep:
+                header_part, body_part = block, ''
+            headers = dict(_HEADER_RE.findall(header_part))
+            body = ''.join(
+                line + '\n' for line in body_part.split('\n') if line.strip()
+            )
+            if headers or body.strip():
+                emails.append({"headers": headers, "body": body})
+        return emails
+
+    def extract_meeting_details(self, emails_content: str) -> str:
+        """Extract meeting information from email content."""
+        # Identical content means an identical answer, so check the cache
+        # before paying for another model round-trip. blake2b is plenty for a
+        # cache fingerprint and cheaper than SHA-256 on cores without SHA-NI.
+        cache_key = hashlib.blake2b(emails_content.encode('utf-8'), digest_size=16).hexdigest()
+        if cache_key in _extraction_cache:
+            if _DEBUG:
+                print("Using cached extraction result")
+            return _extraction_cache[cache_key]
+
+        # Parse the export into individual emails and send them all in one
+        # call as a numbered list: one prompt and one round trip per cycle
+        # instead of per message
+        parsed_emails = self.parse_emails(emails_content)
+        if not parsed_emails:
+            return json.dumps({"found_meetings": False, "meetings": []})
+
+        # Collapse exact duplicates (same invite via two lists, a resend)
+        # before they reach the prompt; tokens scale with unique content
+        seen_emails = set()
+        unique_emails = []
+        for parsed in parsed_emails:
+            fingerprint = (parsed['headers'].get('From', ''),
+                           parsed['headers'].get('Subject', ''),
+                           parsed['headers'].get('Date', ''),
+                           parsed['body'])
+            if fingerprint not in seen_emails:
+                seen_emails.add(fingerprint)
+                unique_emails.append(parsed)
+        parsed_emails = unique_emails
+
+        blocks = []
+        for i, parsed in enumerate(parsed_emails):
+            blocks.append(
+                f"[{i}]\n"
+                f"From: {parsed['headers'].get('From', '')}\n"
+                f"Subject: {parsed['headers'].get('Subject', '')}\n"
+                f"Date: {parsed['headers'].get('Date', '')}\n"
+                f"Content: {parsed['body']}"
             )
+        formatted_content = "Emails:\n" + "\n".join(blocks)
+
+        try:
+            # Retry transient failures (throttling, connection drops, 5xx) with
+            # exponential backoff plus jitter; permanent errors raise immediately
+            max_retries = 3
+            for attempt in range(max_retries + 1):
+                try:
+                    response = self.client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                            {"role": "system", "content": _SYSTEM_PROMPT},
+                            {"role": "user", "content": formatted_content}
+                        ],
+                        # JSON mode: the server guarantees syntactically
+                        # valid JSON, so the fence-stripping and decode
+                        # fallback become belt-and-braces
+                        response_format={"type": "json_object"},
+                        temperature=0.1
+                    )
+                    break
+                except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                    if attempt == max_retries:
+                        raise
+                    wait = min(30, 1.0 * 2 ** attempt) + random.uniform(0, 0.5)
+                    print(f"Transient OpenAI error: {e}. Retrying in {wait:.1f}s...")
+                    time.sleep(wait)
 
             content = response.choices[0].message.content.strip()
-            print(f"OpenAI Response: {content}")  # Debug logging
+            fence_match = _JSON_FENCE_RE.match(content)
+            if fence_match:
+                content = fence_match.group(1)
+            if _DEBUG:
+                print(f"OpenAI Response: {content}")
 
             try:
                 # Validate JSON response
-                parsed_json = json.loads(content)
-                # If we have meetings, process relative dates
+                parsed_json = json_loads(content)
+                # If we have meetings, process relative dates against the
+                # sent date of the email each meeting came from
                 if parsed_json.get("found_meetings", False):
-                    email_date = email.utils.parsedate_to_datetime(email_data['headers'].get('Date', ''))
+                    date_by_sender = {}
+                    default_date = None
+                    for parsed in parsed_emails:
+                        from_header = parsed['headers'].get('From', '')
+                        addr = from_header.split('<')[-1].rstrip('>') if '<' in from_header else from_header
+                        try:
+                            sent = email.utils.parsedate_to_datetime(parsed['headers'].get('Date', ''))
+                        except (TypeError, ValueError):
+                            continue
+                        if default_date is None:
+                            default_date = sent
+                        date_by_sender.setdefault(addr, sent)
                     for meeting in parsed_json["meetings"]:
                         if meeting.get("date") == "tomorrow":
-                            next_day = email_date + timedelta(days=1)
-                            meeting["date"] = next_day.strftime("%Y-%m-%d")
-                return json.dumps(parsed_json)
-            except json.JSONDecodeError:
+                            sent = date_by_sender.get(meeting.get("sender_email"), default_date)
+                            if sent is not None:
+                                meeting["date"] = (sent + timedelta(days=1)).strftime("%Y-%m-%d")
+                result = json.dumps(parsed_json)
+                # Cache only well-formed results, evicting the oldest entry
+                if len(_extraction_cache) >= _EXTRACTION_CACHE_SIZE:
+                    _extraction_cache.pop(next(iter(_extraction_cache)))
+                _extraction_cache[cache_key] = result
+                return result
+            except ValueError:
                 print("Failed to parse JSON response")  # Debug logging
                 return json.dumps({"found_meetings": False, "meetings": []})
 
@@ -120,8 +250,9 @@ Content: {email_data['body']}
         This is the main entry point used by the main.py script.
         """
         try:
-            # Read the email file
-            with open(email_file_path, 'r', encoding='utf-8') as file:
+            # Read the email file in one pass; errors="replace" keeps a stray
+            # non-UTF-8 byte from forcing a full re-read under another codec
+            with open(email_file_path, 'r', encoding='utf-8', errors='replace') as file:
                 emails_content = file.read()
 
             # Extract meeting details
@@ -133,18 +264,6 @@ Content: {email_data['body']}
             # Format results for display
             return self.format_results(json_response)
 
-        except UnicodeDecodeError:
-            # Try alternative encoding if UTF-8 fails
-            try:
-                with open(email_file_path, 'r', encoding='latin-1') as file:
-                    emails_content = file.read()
-
-                json_response = self.extract_meeting_details(emails_content)
-                self.save_to_json(json_response)
-                return self.format_results(json_response)
-
-            except Exception as e:
-                return f"Error processing emails with alternative encoding: {str(e)}"
         except FileNotFoundError:
             return "Error: Email file not found."
         except Exception as e:
@@ -153,8 +272,8 @@ Content: {email_data['body']}
     def format_results(self, json_response: str) -> str:
         """Format the JSON response into a readable string."""
         try:
-            data = json.loads(json_response)
-        except json.JSONDecodeError:
+            data = json_loads(json_response)
+        except ValueError:
             return "Error: Could not parse meeting data"
 
         if not data.get("found_meetings", False):
@@ -175,32 +294,35 @@ Content: {email_data['body']}
     def save_to_json(self, json_response: str) -> None:
         """Save the extracted meeting information to a JSON file."""
         try:
-            data = json.loads(json_response)
-        except json.JSONDecodeError:
+            data = json_loads(json_response)
+        except ValueError:
             print("Error: Invalid JSON response")
             return
 
         current_time = datetime.now().isoformat()
 
         try:
-            with open(self.json_file, 'r') as f:
-                stored_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            with open(self.json_file, 'rb') as f:
+                stored_data = json_loads(f.read())
+        except (FileNotFoundError, ValueError):
             stored_data = {
                 "last_updated": current_time,
                 "meetings": []
             }
 
-        # Add new meetings only if they don't exist
+        # Add new meetings only if they don't exist; a set of composite keys
+        # replaces the old scan of every stored meeting per new meeting
         if data.get("found_meetings", False):
+            seen = {
+                (m.get("date"), m.get("time"), m.get("topic", "").lower(),
+                 m.get("sender", {}).get("email"))
+                for m in stored_data.get("meetings", [])
+            }
             for new_meeting in data.get("meetings", []):
-                if not any(
-                        existing_meeting.get("date") == new_meeting.get("date") and
-                        existing_meeting.get("time") == new_meeting.get("time") and
-                        existing_meeting.get("topic", "").lower() == new_meeting.get("topic", "").lower() and
-                        existing_meeting.get("sender", {}).get("email") == new_meeting.get("sender_email")
-                        for existing_meeting in stored_data.get("meetings", [])
-                ):
+                key = (new_meeting.get("date"), new_meeting.get("time"),
+                       new_meeting.get("topic", "").lower(), new_meeting.get("sender_email"))
+                if key not in seen:
+                    seen.add(key)
                     stored_data["meetings"].append({
                         "date": new_meeting.get("date"),
                         "time": new_meeting.get("time"),
@@ -216,5 +338,4 @@ Content: {email_data['body']}
         stored_data["last_updated"] = current_time
 
         # Write back to file with pretty printing
-        with open(self.json_file, 'w') as f:
-            json.dump(stored_data, f, indent=2, sort_keys=True, ensure_ascii=False)
\ No newline at end of file
+        json_dump_pretty(stored_data, self.json_file)
\ No newline at end of file
@@ -1,9 +1,15 @@
 from gmail import main as gmail_fetch
-from mail_sorter import MeetingSorter
+from mail_sorter import MeetingSorter, json_loads
 from email_writer import EmailAgent
-import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+# Cap on how many meeting requests are processed at the same time; each one
+# is mostly waiting on the Gmail API, so a small pool overlaps that I/O.
+# Overridable per deployment without touching code.
+MAX_CONCURRENT_MEETINGS = int(os.getenv("MAX_CONCURRENT_MEETINGS", "4"))
+
 def log_execution(message):
     timestamp = datetime.now().isoformat()
     print(f"[{timestamp}] {message}")
@@ -28,32 +34,56 @@ def process_new_emails():
         
         # Read the latest meeting requests
         with open('meeting_mails.json', 'r') as f:
-            meeting_data = json.load(f)
+            meeting_data = json_loads(f.read())
         
-        # Process each meeting request
+        # Filter out already processed meetings first; the duplicate check
+        # stays serial so in-batch duplicates are caught before any sends
+        new_meetings = []
+        seen_ids = set()
         for meeting in meeting_data["meetings"]:
             email_id = f"{meeting['date']}_{meeting['time']}_{meeting['sender']['email']}"
-            
-            # Check if we've already responded to this meeting request
-            if not agent.has_responded(email_id):
-                log_execution(f"Processing new meeting request: {email_id}")
-                
-                success = agent.process_meeting_request(
-                    email_id=email_id,
-                    email_content=f"Meeting request for {meeting['topic']} at {meeting['location']}",
-                    sender_info=meeting['sender'],
-                    subject=meeting['topic'],
-                    proposed_date=meeting['date'],
-                    proposed_time=meeting['time']
-                )
-                
-                if success:
-                    log_execution(f"Successfully responded to meeting request: {email_id}")
-                else:
-                    log_execution(f"Failed to respond to meeting request: {email_id}")
-            else:
+
+            if agent.has_responded(email_id) or email_id in seen_ids:
                 log_execution(f"Skipping already processed meeting request: {email_id}")
-                
+                continue
+
+            seen_ids.add(email_id)
+            new_meetings.append((email_id, meeting))
+
+        def process_one(item):
+            email_id, meeting = item
+            log_execution(f"Processing new meeting request: {email_id}")
+            return email_id, agent.process_meeting_request(
+                email_id=email_id,
+                email_content=f"Meeting request for {meeting['topic']} at {meeting['location']}",
+                sender_info=meeting['sender'],
+                subject=meeting['topic'],
+                proposed_date=meeting['date'],
+                proposed_time=meeting['time'],
+                structured={
+                    'date': meeting['date'],
+                    'time': meeting['time'],
+                    'location': meeting['location'],
+                    'agenda': meeting['topic']
+                }
+            )
+
+        # Process the remaining requests concurrently with a bounded pool
+        processed_any = False
+        if new_meetings:
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_MEETINGS) as executor:
+                for email_id, success in executor.map(process_one, new_meetings):
+                    if success:
+                        processed_any = True
+                        log_execution(f"Successfully responded to meeting request: {email_id}")
+                    else:
+                        log_execution(f"Failed to respond to meeting request: {email_id}")
+
+        # One cleanup pass for the whole cycle instead of per message
+        if processed_any and not agent.cleanup_files():
+            log_execution("Warning: files cleanup failed after processing")
+
+
         log_execution("Email processing cycle completed")
         return True
         